@@ -6,26 +6,30 @@ Flask Web Service with single endpoint: /
 """
 
 import os
+import asyncio
 import logging
 import schedule
 import time
 import threading
-import requests
 import random
-from datetime import datetime, timezone
+from datetime import timedelta
 from PIL import Image, ImageDraw, ImageFont
 import io
-import tempfile
+import html
+import binascii
 
+import httpx
 from flask import Flask, jsonify
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 from telegram import Bot
-from telegram.error import TelegramError
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
-# Configure logging
+# Configure logging; set LOG_LEVEL=WARNING in production to drop per-post INFO records
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+    level=os.getenv('LOG_LEVEL', 'INFO').upper()
 )
 logger = logging.getLogger(__name__)
 
@@ -33,10 +37,21 @@ logger = logging.getLogger(__name__)
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')
+# Full tracebacks on unexpected errors are opt-in to keep failure bursts cheap
+DEBUG_TRACEBACKS = os.getenv('DEBUG_TRACEBACKS') == '1'
+# Seconds to wait for each Gemini attempt before giving up on it
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', '60'))
+# Telegram HTTP connection pool size and seconds to wait for a free connection
+TG_POOL_SIZE = int(os.getenv('TG_POOL_SIZE', '8'))
+TG_POOL_TIMEOUT = float(os.getenv('TG_POOL_TIMEOUT', '5'))
 
-# Configure Google Gemini
+# Configure Google Gemini; models are built once and reused for every post
+text_model = None
+image_model = None
 if GOOGLE_API_KEY:
     genai.configure(api_key=GOOGLE_API_KEY)
+    text_model = genai.GenerativeModel('gemini-1.5-flash')
+    image_model = genai.GenerativeModel('gemini-2.5-flash-image-preview')
     logger.info("Google Gemini configured successfully")
 else:
     logger.warning("GOOGLE_API_KEY not found")
@@ -44,14 +59,26 @@ else:
 # Initialize Flask app
 app = Flask(__name__)
 
-# Initialize Telegram bot
+# Initialize Telegram bot with one pooled HTTP client reused for every post
 bot = None
 if TELEGRAM_BOT_TOKEN:
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    bot = Bot(
+        token=TELEGRAM_BOT_TOKEN,
+        request=HTTPXRequest(
+            connection_pool_size=TG_POOL_SIZE,
+            pool_timeout=TG_POOL_TIMEOUT,
+            connect_timeout=10.0,
+            read_timeout=20.0
+        )
+    )
     logger.info("Telegram bot initialized")
 else:
     logger.warning("TELEGRAM_BOT_TOKEN not found")
 
+# Bot methods and Gemini calls are coroutines; the scheduler thread drives them
+# on this loop so the bot's connection pool stays open between posts
+loop = asyncio.new_event_loop()
+
 # Daily post counter
 daily_post_count = 0
 MAX_DAILY_POSTS = 20
@@ -80,57 +107,110 @@ POST_TOPICS = [
     "Kelajakdagi AI tendensiyalar"
 ]
 
-def generate_text_content(topic):
+# Static prompt and message text, built once at import
+TEXT_PROMPT_TEMPLATE = """{topic} mavzusida qiziq va ma'lumotli post yoz. Post o'zbek tilida bo'lishi kerak.
+
+Quyidagi formatda yoz:
+- 2-3 ta qiziq faktlar
+- Amaliy maslahatlar
+- Kelajak istiqbollari
+- Hashtag'lar qo'sh
+
+Post 200-300 so'zdan iborat bo'lsin."""
+
+# English prompt for better image generation
+IMAGE_PROMPT_TEMPLATE = "High-quality digital art about {topic}, futuristic technology, AI concepts, modern design, vibrant colors"
+
+FALLBACK_CAPTION_TEMPLATE = "🤖 {topic}\n\nSun'iy intellekt sohasidagi eng so'nggi yangiliklarni kuzatib boring!\n\n#AI #SuniyIntellekt #Texnologiya"
+
+STARTUP_BANNER = "🤖 AI Post Bot Render.com Web Service da ishga tushdi. 07:00-21:00 UTC oralig'ida 20 ta post jo'natiladi."
+
+async def call_gemini(model, prompt, attempts=3):
+    """Call Gemini with a per-attempt timeout, retrying timeouts, rate limits and
+    transient server errors with exponential backoff"""
+    for attempt in range(attempts):
+        try:
+            # retry=None turns off the SDK's built-in retry so this loop is
+            # the only retry layer
+            request = model.generate_content_async(
+                prompt, request_options={'retry': None, 'timeout': GEMINI_TIMEOUT}
+            )
+            return await asyncio.wait_for(request, timeout=GEMINI_TIMEOUT)
+        except (asyncio.TimeoutError,
+                google_exceptions.ResourceExhausted,
+                google_exceptions.ServiceUnavailable,
+                google_exceptions.DeadlineExceeded) as e:
+            if attempt == attempts - 1:
+                raise
+            delay = 0.5 * 2 ** attempt + random.uniform(0, 0.25)
+            logger.warning("Gemini call failed (%r), retrying in %.2f seconds", e, delay)
+            await asyncio.sleep(delay)
+
+async def generate_text_content(topic):
     """Generate Uzbek text content using Gemini 1.5 Flash"""
+    if text_model is None:
+        # No GOOGLE_API_KEY; the caller falls back to the static caption
+        return None
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        prompt = f"""
-        {topic} mavzusida qiziq va ma'lumotli post yoz. Post o'zbek tilida bo'lishi kerak.
-        
-        Quyidagi formatda yoz:
-        - 2-3 ta qiziq faktlar
-        - Amaliy maslahatlar
-        - Kelajak istiqbollari
-        - Hashtag'lar qo'sh
-        
-        Post 200-300 so'zdan iborat bo'lsin.
-        """
-        
-        response = model.generate_content(prompt)
-        return response.text if response.text else None
+        prompt = TEXT_PROMPT_TEMPLATE.format(topic=topic)
+        response = await call_gemini(text_model, prompt)
+        text = extract_text(response)
+        if not text:
+            logger.warning("Gemini returned no text content")
+        return text
         
+    except asyncio.TimeoutError:
+        logger.error("Gemini text generation timed out (%s seconds per attempt)", GEMINI_TIMEOUT)
+        return None
+    except google_exceptions.GoogleAPIError as e:
+        logger.warning("Gemini API error during text generation: %s", e)
+        return None
     except Exception as e:
-        logger.error(f"Error generating text content: {e}")
+        logger.error("Error generating text content: %s", e, exc_info=DEBUG_TRACEBACKS)
+        return None
+
+def extract_text(response):
+    """Return the text parts of a Gemini response joined together, or None"""
+    if not response.candidates:
+        return None
+    content = response.candidates[0].content
+    if not content:
+        return None
+    text = ''.join(getattr(part, 'text', '') for part in content.parts).strip()
+    return text or None
+
+def extract_image_bytes(response):
+    """Return the first inline image in a Gemini response as bytes, or None"""
+    if not response.candidates:
+        return None
+    content = response.candidates[0].content
+    if not content:
         return None
+    for part in content.parts:
+        inline_data = getattr(part, 'inline_data', None)
+        raw_data = getattr(inline_data, 'data', None) if inline_data else None
+        if raw_data:
+            return binascii.a2b_base64(raw_data) if isinstance(raw_data, str) else raw_data
+    return None
 
-def generate_image_with_gemini(topic):
+async def generate_image_with_gemini(topic):
     """Generate image using Gemini 2.5 Flash Image"""
+    if image_model is None:
+        # No GOOGLE_API_KEY; the caller falls back to the PIL image
+        return None
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash-image-preview')
-        
-        # Create English prompt for better image generation
-        image_prompt = f"High-quality digital art about {topic}, futuristic technology, AI concepts, modern design, vibrant colors"
-        
-        response = model.generate_content(image_prompt)
+        image_prompt = IMAGE_PROMPT_TEMPLATE.format(topic=topic)
+        response = await call_gemini(image_model, image_prompt)
+        return extract_image_bytes(response)
         
-        # Extract image data
-        if response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if candidate.content and candidate.content.parts:
-                for part in candidate.content.parts:
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        if hasattr(part.inline_data, 'data'):
-                            import base64
-                            raw_data = part.inline_data.data
-                            if isinstance(raw_data, str):
-                                return base64.b64decode(raw_data)
-                            else:
-                                return raw_data
+    except asyncio.TimeoutError:
+        logger.error("Gemini image generation timed out (%s seconds per attempt)", GEMINI_TIMEOUT)
+        return None
+    except google_exceptions.GoogleAPIError as e:
+        logger.warning("Gemini API error during image generation: %s", e)
         return None
-        
     except Exception as e:
-        logger.error(f"Error generating image with Gemini: {e}")
+        logger.error("Error generating image with Gemini: %s", e, exc_info=DEBUG_TRACEBACKS)
         return None
 
 def create_text_image(text, topic):
@@ -190,33 +270,67 @@ def create_text_image(text, topic):
         return img_bytes.getvalue()
         
     except Exception as e:
-        logger.error(f"Error creating text image: {e}")
+        logger.error("Error creating text image: %s", e, exc_info=DEBUG_TRACEBACKS)
         return None
 
-def send_post_to_channel():
+async def send_channel_photo(image_data, caption, attempts=3):
+    """Send a photo to the channel straight from memory, retrying flood control and connection errors"""
+    for attempt in range(attempts):
+        image_file = io.BytesIO(image_data)
+        image_file.name = 'post.png'
+        try:
+            return await bot.send_photo(
+                chat_id=TELEGRAM_CHANNEL_ID,
+                photo=image_file,
+                caption=caption,
+                parse_mode='HTML'
+            )
+        except RetryAfter as e:
+            if attempt == attempts - 1:
+                raise
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning("Telegram flood control hit, retrying in %s seconds", delay)
+        except BadRequest:
+            # Rejected request; sending it again will not help
+            raise
+        except NetworkError as e:
+            # send_photo is not idempotent: after a read/write timeout or a
+            # dropped connection Telegram may already have published the photo,
+            # and retrying would duplicate the channel post. Only retry errors
+            # raised before the request reached Telegram. This relies on
+            # HTTPXRequest.do_request raising TimedOut/NetworkError from the
+            # original httpx exception; recheck it when upgrading PTB or httpx.
+            may_have_been_sent = not isinstance(
+                e.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+            )
+            if attempt == attempts - 1 or may_have_been_sent:
+                raise
+            delay = 0.5 * 2 ** attempt
+            logger.warning("Network error sending post (%s), retrying in %s seconds", e, delay)
+        await asyncio.sleep(delay)
+
+async def send_post_to_channel():
     """Send AI-generated post to Telegram channel"""
     global daily_post_count
     
     if daily_post_count >= MAX_DAILY_POSTS:
-        logger.info(f"Daily limit reached ({MAX_DAILY_POSTS} posts)")
-        return
-    
-    if not bot or not TELEGRAM_CHANNEL_ID:
-        logger.error("Bot or channel ID not configured")
+        logger.info("Daily limit reached (%d posts)", MAX_DAILY_POSTS)
         return
     
     try:
         # Select random topic
         topic = random.choice(POST_TOPICS)
-        logger.info(f"Generating post for topic: {topic}")
+        logger.info("Generating post for topic: %s", topic)
         
-        # Generate text content
-        text_content = generate_text_content(topic)
+        # Text and image only depend on the topic, so generate them concurrently
+        text_content, image_data = await asyncio.gather(
+            generate_text_content(topic),
+            generate_image_with_gemini(topic)
+        )
         if not text_content:
-            text_content = f"🤖 {topic}\n\nSun'iy intellekt sohasidagi eng so'nggi yangiliklarni kuzatib boring!\n\n#AI #SuniyIntellekt #Texnologiya"
-        
-        # Try to generate image with Gemini
-        image_data = generate_image_with_gemini(topic)
+            text_content = FALLBACK_CAPTION_TEMPLATE.format(topic=topic)
         
         # If Gemini fails, create text image with PIL
         if not image_data:
@@ -227,36 +341,26 @@ def send_post_to_channel():
             logger.error("Failed to create any image")
             return
         
-        # Save image to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-            temp_file.write(image_data)
-            temp_file_path = temp_file.name
-        
         # Send to channel
         try:
-            with open(temp_file_path, 'rb') as image_file:
-                bot.send_photo(
-                    chat_id=TELEGRAM_CHANNEL_ID,
-                    photo=image_file,
-                    caption=text_content,
-                    parse_mode='HTML'
-                )
+            # Captions use HTML parse mode; escape generated text so a stray
+            # '<' or '&' cannot make Telegram reject the post. Telegram counts
+            # the 1024-character caption limit after entity parsing, so the
+            # raw text is cut before escaping.
+            await send_channel_photo(image_data, html.escape(text_content[:1024], quote=False))
             
             daily_post_count += 1
-            logger.info(f"Post {daily_post_count}/{MAX_DAILY_POSTS} sent successfully to channel")
+            logger.info("Post %d/%d sent successfully to channel", daily_post_count, MAX_DAILY_POSTS)
             
         except TelegramError as e:
-            logger.error(f"Failed to send post to channel: {e}")
-        
-        finally:
-            # Clean up temp file
-            try:
-                os.unlink(temp_file_path)
-            except OSError:
-                pass
+            logger.error("Failed to send post to channel: %s", e)
                 
     except Exception as e:
-        logger.error(f"Error in send_post_to_channel: {e}")
+        logger.error("Error in send_post_to_channel: %s", e, exc_info=DEBUG_TRACEBACKS)
+
+def post_job():
+    """Scheduled job: run one post on the scheduler's event loop"""
+    loop.run_until_complete(send_post_to_channel())
 
 def reset_daily_counter():
     """Reset daily post counter at midnight"""
@@ -277,11 +381,12 @@ def setup_schedule():
     
     current_hour = start_hour
     current_minute = 0
+    post_times = []
     
     while current_hour < end_hour:
         time_str = f"{current_hour:02d}:{current_minute:02d}"
-        schedule.every().day.at(time_str).do(send_post_to_channel)
-        logger.info(f"Scheduled post at {time_str} UTC")
+        schedule.every().day.at(time_str).do(post_job)
+        post_times.append(time_str)
         
         # Add interval
         current_minute += interval_minutes
@@ -289,10 +394,21 @@ def setup_schedule():
             current_hour += current_minute // 60
             current_minute = current_minute % 60
     
-    logger.info(f"Scheduled {len(schedule.jobs)-1} daily posts between {start_hour:02d}:00-{end_hour:02d}:00 UTC")
+    # Log the whole schedule as one record instead of one line per slot
+    logger.info(
+        "Scheduled %d daily posts between %02d:00-%02d:00 UTC at: %s",
+        len(post_times), start_hour, end_hour, ', '.join(post_times)
+    )
 
 def run_scheduler():
     """Run the scheduler in background thread"""
+    asyncio.set_event_loop(loop)
+    if bot:
+        try:
+            loop.run_until_complete(bot.initialize())
+        except TelegramError as e:
+            logger.error("Failed to initialize Telegram bot: %s", e)
+    
     while True:
         schedule.run_pending()
         time.sleep(60)
@@ -304,19 +420,24 @@ def health_check():
 
 def main():
     """Main function"""
-    print("🤖 AI Post Bot Render.com Web Service da ishga tushdi. 07:00-21:00 UTC oralig'ida 20 ta post jo'natiladi.")
+    print(STARTUP_BANNER)
     
-    # Setup schedule
-    setup_schedule()
-    
-    # Start scheduler in background thread
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
-    logger.info("Scheduler thread started")
+    # Configuration cannot change at runtime, so it is checked once here
+    # instead of on every scheduled post
+    if bot and TELEGRAM_CHANNEL_ID:
+        # Setup schedule
+        setup_schedule()
+        
+        # Start scheduler in background thread
+        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
+        scheduler_thread.start()
+        logger.info("Scheduler thread started")
+    else:
+        logger.error("Bot or channel ID not configured, channel posting disabled")
     
     # Start Flask app
     port = int(os.environ.get('PORT', 5000))
-    logger.info(f"Starting Flask app on port {port}")
+    logger.info("Starting Flask app on port %d", port)
     app.run(host='0.0.0.0', port=port, debug=False)
 
 if __name__ == '__main__':